@@ -1,12 +1,14 @@
+import math
 import os
-import re
-from textwrap import wrap
-from mrkdwn_analysis import MarkdownAnalyzer
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from card_parser import PARSE_CACHE_VERSION, process_one
 from reportlab.lib.pagesizes import letter, inch
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import (
     BaseDocTemplate, Paragraph, Spacer, Table, TableStyle,
-    PageTemplate, Frame, PageBreak
+    PageTemplate, Frame, PageBreak, FrameBreak, KeepInFrame, HRFlowable, TopPadder
 )
 from reportlab.lib import colors
 from reportlab.pdfbase import pdfmetrics
@@ -34,6 +36,8 @@ MIN_FONT_SIZE = 6
 MAX_TITLE_SIZE = 12
 MAX_BODY_SIZE = 10
 LINE_SPACING = 1.2
+# Body sizes auto_scale_text can choose, largest first
+BODY_SIZES = [MAX_BODY_SIZE - 0.5*i for i in range(int((MAX_BODY_SIZE - MIN_FONT_SIZE)*2) + 1)]
 
 # ===== FOOTER SETTINGS =====
 FOOTER_HEIGHT = 36  # 0.5" (fixed)
@@ -41,219 +45,319 @@ PAGE_COL_WIDTH = 48  # Fixed width for page column (48pt = 0.67")
 MAX_FOOTER_FONT_SIZE = 8
 MIN_FOOTER_FONT_SIZE = 6
 
-def auto_scale_text(text, max_width, max_height):
-    """Find maximum font size that fits text in available space"""
-    font_size = MAX_BODY_SIZE
-    best_size = MIN_FONT_SIZE
-    best_wrapped = []
-    
-    while font_size >= MIN_FONT_SIZE:
-        avg_char_width = pdfmetrics.stringWidth("n", BODY_FONT_NAME, font_size)
-        chars_per_line = int(max_width / avg_char_width)
-        wrapped = wrap(text[:2000], width=chars_per_line)
-        line_height = font_size * LINE_SPACING
-        needed_height = len(wrapped) * line_height
-        
-        if needed_height <= max_height:
-            return font_size, '<br/>'.join(wrapped)
-        
-        font_size -= 0.5
-    
-    # Fallback to minimum size with truncation
-    wrapped = wrap(text, width=int(max_width/avg_char_width))[:int(max_height/(MIN_FONT_SIZE*LINE_SPACING))]
-    return MIN_FONT_SIZE, '<br/>'.join(wrapped)
+# ===== PARSE SETTINGS =====
+# A parse costs ~50us, so a process pool (each spawned worker re-imports this
+# script and ReportLab) only pays off for very large batches
+PARALLEL_PARSE_MIN_FILES = 20000
 
-def fit_title_font(title, max_width):
-    styles = getSampleStyleSheet()
-    for font_size in range(MAX_TITLE_SIZE, MIN_FONT_SIZE-1, -1):
-        title_style = ParagraphStyle(
-            'TempTitleStyle',
-            parent=styles['Normal'],
-            fontName=TITLE_FONT_NAME,
+# ===== PARSE CACHE SETTINGS =====
+PARSE_CACHE_FILE = os.path.expanduser('~/.cache/bear_cards/parse.pkl')
+
+# ===== METRIC CACHES =====
+_WIDTH_CACHE: dict[tuple[str, float, str], float] = {}
+
+def _sw(text, font_name, font_size):
+    """Memoized pdfmetrics.stringWidth"""
+    key = (font_name, font_size, text)
+    width = _WIDTH_CACHE.get(key)
+    if width is None:
+        width = _WIDTH_CACHE[key] = pdfmetrics.stringWidth(text, font_name, font_size)
+    return width
+
+# ===== STYLE CACHE =====
+_SAMPLE_STYLES = getSampleStyleSheet()
+_STYLE_CACHE = {}
+
+def _style(kind, font_size):
+    """Shared ParagraphStyle for a 'title', 'body' or 'footer' at font_size"""
+    key = (kind, font_size)
+    style = _STYLE_CACHE.get(key)
+    if style is None:
+        style = _STYLE_CACHE[key] = ParagraphStyle(
+            f'{kind.capitalize()}Style{font_size}',
+            parent=_SAMPLE_STYLES['Normal'],
+            fontName=TITLE_FONT_NAME if kind == 'title' else BODY_FONT_NAME,
             fontSize=font_size,
             leading=font_size * LINE_SPACING,
-            alignment=1
+            alignment=1 if kind == 'title' else 0,
+            spaceBefore=0,
+            spaceAfter=0
         )
-        para = Paragraph(f"<b>{title}</b>", title_style)
-        w, h = para.wrap(max_width, 1000)
-        min_w = para.minWidth()
-        # Must fit in one line and not overflow horizontally
-        if h <= title_style.leading + 1 and min_w <= max_width:
-            return font_size
-    return MIN_FONT_SIZE
+    return style
+
+# Glyph widths at 1pt, summed to measure strings without pdfmetrics. Printable
+# ASCII is filled in at import (which also loads both fonts' metrics, so no card
+# pays the lazy load on its first stringWidth call); other characters are added
+# the first time they are measured.
+_CHAR_W = {
+    font_name: {c: pdfmetrics.stringWidth(c, font_name, 1.0) for c in map(chr, range(32, 127))}
+    for font_name in (BODY_FONT_NAME, TITLE_FONT_NAME)
+}
+_MIN_CHAR_W = min(_CHAR_W[BODY_FONT_NAME].values())
+
+def _fast_width(s, font_size, font_name=BODY_FONT_NAME):
+    """String width from the glyph table, measuring unseen non-ASCII characters"""
+    table = _CHAR_W[font_name]
+    space = table[' ']
+    if s.isascii():
+        return font_size * sum([table.get(c, space) for c in s])
+    width = 0.0
+    for c in s:
+        w = table.get(c)
+        if w is None:
+            if c.isascii():
+                w = space
+            else:
+                w = table[c] = pdfmetrics.stringWidth(c, font_name, 1.0)
+        width += w
+    return font_size * width
 
+def _wrap_words(words, word_widths, space_width, line_width, indent=0):
+    """Greedily pack words into lines no wider than line_width (all widths at 1pt)
 
+    indent is width already taken on the first line.
+    """
+    lines = []
+    line = []
+    width = indent
+    for word, word_width in zip(words, word_widths):
+        needed = width + (space_width if line else 0) + word_width
+        if needed > line_width and (line or indent):
+            lines.append(' '.join(line))
+            line = [word]
+            width = word_width
+            indent = 0
+        else:
+            line.append(word)
+            width = needed
+    if line:
+        lines.append(' '.join(line))
+    return lines
 
+def auto_scale_text(text, max_width, max_height, label=''):
+    """Find maximum font size that fits text in available space
+
+    label is the bold prefix rendered ahead of the text on its first line.
+    Returns (font_size, text, paragraph). The Paragraph itself measures each
+    candidate, so the text comes back unwrapped unless it had to be truncated
+    at the minimum size; paragraph is the measured Paragraph at font_size
+    for reuse, or None when no Paragraph was built.
+    """
+    space_width = _fast_width(' ', 1.0)
+    indent = _fast_width(label, 1.0, TITLE_FONT_NAME) + space_width if label else 0
+    # Paragraph collapses whitespace runs, so measure the collapsed text
+    total_width = indent + _fast_width(' '.join(text.split()), 1.0)
+    # Short or empty text that fits on one line at the largest size needs no search
+    if total_width * MAX_BODY_SIZE <= max_width and MAX_BODY_SIZE * LINE_SPACING <= max_height:
+        return MAX_BODY_SIZE, text, None
+    markup = f"<b>{label}</b> {text}" if label else text
+
+    for font_size in BODY_SIZES:
+        line_width = max_width / font_size
+        line_height = font_size * LINE_SPACING
+        # Lines needed even with perfect packing. Sizes failing this cannot fit,
+        # so the first size that passes and wraps within max_height is the
+        # largest fit, usually found with one or two Paragraph wraps.
+        min_lines = math.ceil((total_width + space_width) / (line_width + space_width))
+        if min_lines * line_height > max_height:
+            continue
+        para = Paragraph(markup, _style('body', font_size))
+        _, height = para.wrap(max_width, max_height)
+        if height <= max_height:
+            return font_size, text, para
+    
+    # Fallback to minimum size with truncation
+    max_lines = int(max_height / (MIN_FONT_SIZE * LINE_SPACING))
+    # Even all-narrowest-glyph text fills max_lines within this many characters
+    budget = int(max_lines * max_width / (MIN_FONT_SIZE * _MIN_CHAR_W)) + 1
+    words = text[:budget].split()
+    if len(words) > 1 and len(text) > budget and not text[budget].isspace():
+        words.pop()  # the slice cut this word short
+    word_widths = [_fast_width(word, 1.0) for word in words]
+    wrapped = _wrap_words(words, word_widths, space_width, max_width / MIN_FONT_SIZE, indent)
+    return MIN_FONT_SIZE, ' '.join(wrapped[:max_lines]), None
+
+def fit_title_font(title, max_width):
+    """Largest whole-point title size that fits on one line"""
+    title_width_1pt = _fast_width(title, 1.0, TITLE_FONT_NAME)
+    if title_width_1pt <= 0:
+        return MAX_TITLE_SIZE
+    ideal_size = max_width / title_width_1pt
+    return max(MIN_FONT_SIZE, min(MAX_TITLE_SIZE, math.floor(ideal_size)))
+
+
+@lru_cache(maxsize=4096)  # Cards from one source share their footer text
 def calculate_footer_font(source_text, page_text):
     """Calculate maximum font size that fits both footer columns"""
-    font_size = MAX_FOOTER_FONT_SIZE
-    while font_size >= MIN_FOOTER_FONT_SIZE:
-        source_width = pdfmetrics.stringWidth(source_text, BODY_FONT_NAME, font_size)
-        page_width = pdfmetrics.stringWidth(page_text, BODY_FONT_NAME, font_size)
-        available_source_width = CONTENT_WIDTH - PAGE_COL_WIDTH - 6  # 6pt padding
-        
-        if source_width <= available_source_width and page_width <= PAGE_COL_WIDTH:
-            return font_size
-        font_size -= 0.5  # Fine-grained scaling
-    return MIN_FOOTER_FONT_SIZE
+    available_source_width = CONTENT_WIDTH - PAGE_COL_WIDTH - 6  # 6pt padding
+    limit = MAX_FOOTER_FONT_SIZE
+    source_width_1pt = _sw(source_text, BODY_FONT_NAME, 1.0)
+    page_width_1pt = _sw(page_text, BODY_FONT_NAME, 1.0)
+    if source_width_1pt > 0:
+        limit = min(limit, available_source_width / source_width_1pt)
+    if page_width_1pt > 0:
+        limit = min(limit, PAGE_COL_WIDTH / page_width_1pt)
+    # Snap down to the 0.5pt scaling grid
+    font_size = math.floor(limit * 2) / 2
+    return max(MIN_FOOTER_FONT_SIZE, font_size)
 
 def create_card_content(card_title, quote, analysis, source, page_number):
-    styles = getSampleStyleSheet()
-    
     # Auto-scale title
     title_font_size = fit_title_font(card_title, CONTENT_WIDTH)
-    title_height = title_font_size * LINE_SPACING + 6  # + red line
+    title_height = title_font_size * LINE_SPACING + 2 + 1.5 + 6  # + red line
     
     # Available space for paragraphs
     para_available_height = CONTENT_HEIGHT - title_height - 12 - FOOTER_HEIGHT
     
-    # Auto-scale quote and analysis
-    quote_font, quote_content = auto_scale_text(quote, CONTENT_WIDTH, para_available_height/2)
-    analysis_font, analysis_content = auto_scale_text(analysis, CONTENT_WIDTH, para_available_height/2)
+    # Auto-scale quote and analysis, sharing the height left after the 6pt spacer
+    half_height = (para_available_height - 6) / 2
+    quote_font, quote_content, quote_para = auto_scale_text(
+        quote, CONTENT_WIDTH, half_height, "Quote:")
+    analysis_font, analysis_content, analysis_para = auto_scale_text(
+        analysis, CONTENT_WIDTH, half_height, "Analysis:")
     body_font_size = min(quote_font, analysis_font)
 
     # Create styles
-    title_style = ParagraphStyle(
-        'TitleStyle',
-        parent=styles['Normal'],
-        fontName=TITLE_FONT_NAME,
-        fontSize=title_font_size,
-        leading=title_font_size * LINE_SPACING,
-        alignment=1,
-        spaceAfter=0
-    )
-    body_style = ParagraphStyle(
-        'BodyStyle',
-        parent=styles['Normal'],
-        fontName=BODY_FONT_NAME,
-        fontSize=body_font_size,
-        leading=body_font_size * LINE_SPACING,
-        spaceBefore=0,
-        spaceAfter=0
-    )
+    title_style = _style('title', title_font_size)
+    body_style = _style('body', body_font_size)
 
     # Auto-scale footer
     source_text = f"Source: {source}"
     page_text = f"Page: {page_number}"
     footer_font_size = calculate_footer_font(source_text, page_text)
-    footer_style = ParagraphStyle(
-        'FooterStyle',
-        parent=styles['Normal'],
-        fontName=BODY_FONT_NAME,
-        fontSize=footer_font_size,
-        leading=footer_font_size * 1.2,
-        spaceBefore=0,
-        spaceAfter=0
-    )
+    footer_style = _style('footer', footer_font_size)
 
-    # Title with red line (full width)
-    title_table = Table(
-        [[Paragraph(f"<b>{card_title}</b>", title_style)]],
-        colWidths=CARD_WIDTH,  # Use full card width
-        rowHeights=[title_height],
-        style=TableStyle([
-            ('BOTTOMPADDING', (0,0), (-1,0), 6),
-            ('LEFTPADDING', (0,0), (-1,-1), 0),
-            ('RIGHTPADDING', (0,0), (-1,-1), 0)
-        ])
-    )
+    # Title with red line
+    title_flowables = [
+        Paragraph(f"<b>{card_title}</b>", title_style),
+        HRFlowable(width=CONTENT_WIDTH, thickness=1.5, color=colors.red,
+                   spaceBefore=2, spaceAfter=6)
+    ]
 
-    # Paragraph content
+    # Paragraph content, reusing the measured Paragraph when it is at the body size
+    if quote_para is None or quote_font != body_font_size:
+        quote_para = Paragraph(f"<b>Quote:</b> {quote_content}", body_style)
+    if analysis_para is None or analysis_font != body_font_size:
+        analysis_para = Paragraph(f"<b>Analysis:</b> {analysis_content}", body_style)
     para_flowables = [
-        Paragraph(f"<b>Quote:</b> {quote_content}", body_style),
+        quote_para,
         Spacer(1, 6),
-        Paragraph(f"<b>Analysis:</b> {analysis_content}", body_style)
+        analysis_para
     ]
-    para_table = Table(
-        [[para_flowables]],
-        colWidths=CONTENT_WIDTH,
-        rowHeights=[para_available_height],
-        style=TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('LEFTPADDING', (0,0), (-1,-1), 0)
-        ])
-    )
 
-    # Footer table with auto-scaling
+    # Footer table with auto-scaling (the only columns on the card)
     footer_table = Table(
         [[
             Paragraph(f"<b>Source:</b> {source}", footer_style),
             Paragraph(f"<b>Page:</b> {page_number}", footer_style)
         ]],
-        colWidths=[None, PAGE_COL_WIDTH],  # Source expands, Page fixed
+        colWidths=[CONTENT_WIDTH - PAGE_COL_WIDTH, PAGE_COL_WIDTH],  # Source expands, Page fixed
         rowHeights=[FOOTER_HEIGHT],
         style=TableStyle([
             ('VALIGN', (0,0), (-1,-1), 'BOTTOM'),
             ('ALIGN', (0,0), (-1,-1), 'LEFT'),
             ('LEFTPADDING', (0,0), (-1,-1), 0),
             ('RIGHTPADDING', (0,0), (-1,-1), 0),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
         ])
     )
-    
-    return Table(
-    [
-        [title_table],
-        [Spacer(1, 12)],
-        [para_table],
-        [footer_table]
-    ],
-    colWidths=CARD_WIDTH,
-    rowHeights=[
-        title_height,
-        12,  # Spacer
-        para_available_height,
-        FOOTER_HEIGHT
-    ],
-    style=TableStyle([
-        # Title table style (no padding)
-        ('PADDING', (0,0), (-1,0), 0),  # First row (title)
-        ('LINEBELOW', (0,0), (-1,0), 1.5, colors.red),  # Red line under title
-        
-        # Content area style (12pt padding)
-        ('PADDING', (0,1), (-1,-2), CARD_MARGIN),  # Middle rows (paragraph)
-        ('BOTTOMPADDING', (-1,-1), (-1,-1), CARD_MARGIN)  # Footer
-    ])
-)
+
+    # Each card has a frame to itself, so TopPadder drops the footer to its bottom
+    return [
+        KeepInFrame(
+            CONTENT_WIDTH,
+            CONTENT_HEIGHT - FOOTER_HEIGHT,
+            title_flowables + [Spacer(1, 12)] + para_flowables,
+            mode='shrink'
+        ),
+        TopPadder(footer_table)
+    ]
 
 
-def parse_markdown(filename):
-    analyzer = MarkdownAnalyzer(filename)
-    headers = analyzer.identify_headers().get("Header", [])
-    if not headers:
-        raise ValueError(f"No headers found in {filename}")
-    header_text = headers[0].get('text', '')
-    page_match = re.match(r'Page\s*(\d+)\s*-\s*(.*)', header_text)
-    if not page_match:
-        raise ValueError(f"Header format error in {filename}")
-    page_number, card_title = page_match.groups()
-    paragraphs = analyzer.identify_paragraphs().get("Paragraph", [])
-    source = "Unknown"
-    if paragraphs:
-        source_match = re.search(r'\[\[(.*?)\]\]', paragraphs[0])
-        if source_match:
-            source = source_match.group(1)
-    blockquotes = analyzer.identify_blockquotes().get("Blockquote", [])
-    quote = blockquotes[0] if blockquotes else ""
-    analysis = ""
-    for para in paragraphs:
-        if para.strip().startswith("**Analysis:**"):
-            analysis = para.replace("**Analysis:**", "").strip()
-            break
-    return card_title, quote, analysis, source, page_number
+def _load_parse_cache():
+    """Card data from earlier runs, keyed by (path, st_mtime_ns, st_size)"""
+    try:
+        with open(PARSE_CACHE_FILE, 'rb') as f:
+            version, cache = pickle.load(f)
+    except Exception:
+        return {}
+    return cache if version == PARSE_CACHE_VERSION else {}
+
+def _save_parse_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(PARSE_CACHE_FILE), exist_ok=True)
+        tmp_file = PARSE_CACHE_FILE + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((PARSE_CACHE_VERSION, cache), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, PARSE_CACHE_FILE)
+    except OSError as e:
+        print(f"Could not write parse cache: {str(e)}")
 
 def avery5388_page_template():
     available_height = PAGE_HEIGHT - PAGE_TOP_MARGIN - PAGE_BOTTOM_MARGIN
     vertical_gap = (available_height - 3*CARD_HEIGHT) / 2
+    # Frame padding is the card margin, so each card lays out in CONTENT_WIDTH x CONTENT_HEIGHT
+    padding = dict(leftPadding=CARD_MARGIN, rightPadding=CARD_MARGIN,
+                   topPadding=CARD_MARGIN, bottomPadding=CARD_MARGIN)
     return PageTemplate(
         frames=[
-            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN + 2*CARD_HEIGHT + 2*vertical_gap, CARD_WIDTH, CARD_HEIGHT),
-            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN + CARD_HEIGHT + vertical_gap, CARD_WIDTH, CARD_HEIGHT),
-            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN, CARD_WIDTH, CARD_HEIGHT)
+            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN + 2*CARD_HEIGHT + 2*vertical_gap, CARD_WIDTH, CARD_HEIGHT, **padding),
+            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN + CARD_HEIGHT + vertical_gap, CARD_WIDTH, CARD_HEIGHT, **padding),
+            Frame(PAGE_LEFT_MARGIN, PAGE_BOTTOM_MARGIN, CARD_WIDTH, CARD_HEIGHT, **padding)
         ],
         pagesize=letter
     )
 
 def make_avery5388_pdf(md_dir, output_file):
+    with os.scandir(md_dir) as it:
+        md_entries = sorted(
+            (e for e in it if e.name.endswith('.md') and e.is_file()),
+            key=lambda e: e.name
+        )
+    # Reuse earlier parses of unchanged files, keyed by absolute path
+    md_dir_abs = os.path.abspath(md_dir)
+    keys = []
+    for e in md_entries:
+        st = e.stat()
+        keys.append((os.path.join(md_dir_abs, e.name), st.st_mtime_ns, st.st_size))
+    old_cache = _load_parse_cache()
+    parsed = [(old_cache[key], None) if key in old_cache else None for key in keys]
+    misses = [i for i, result in enumerate(parsed) if result is None]
+    miss_paths = [md_entries[i].path for i in misses]
+    if len(misses) >= PARALLEL_PARSE_MIN_FILES:
+        # Parse the rest in parallel; results come back in input order
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(process_one, miss_paths, chunksize=8))
+    else:
+        results = [process_one(path) for path in miss_paths]
+    for i, result in zip(misses, results):
+        parsed[i] = result
+    # Entries for other directories are kept; for this one only current files
+    # are, so deleted and edited files drop out
+    new_cache = {key: card_data for key, card_data in old_cache.items()
+                 if os.path.dirname(key[0]) != md_dir_abs}
+    new_cache.update((key, card_data) for key, (card_data, error) in zip(keys, parsed) if error is None)
+    cards = []
+    for md_entry, (card_data, error) in zip(md_entries, parsed):
+        if error is not None:
+            print(f"Skipping {md_entry.name}: {error}")
+            continue
+        try:
+            cards.append(create_card_content(*card_data))
+        except Exception as e:
+            print(f"Skipping {md_entry.name}: {str(e)}")
+    # Lay the cards out a page (three frames) at a time. A shrinking card
+    # would squeeze into whatever is left of a used frame, so every card
+    # after the first on a page starts a fresh frame.
+    pages = [cards[i:i + 3] for i in range(0, len(cards), 3)]
+    elements = []
+    for page_index, page_cards in enumerate(pages):
+        if page_index:
+            elements.append(PageBreak())
+        for frame_index, card in enumerate(page_cards):
+            if frame_index:
+                elements.append(FrameBreak)
+            elements.extend(card)
     doc = BaseDocTemplate(
         output_file,
         pagesize=letter,
@@ -263,20 +367,9 @@ def make_avery5388_pdf(md_dir, output_file):
         bottomMargin=0
     )
     doc.addPageTemplates([avery5388_page_template()])
-    elements = []
-    md_files = sorted([f for f in os.listdir(md_dir) if f.endswith('.md')])
-    for i, md_file in enumerate(md_files):
-        try:
-            full_path = os.path.join(md_dir, md_file)
-            card_data = parse_markdown(full_path)
-            elements.append(create_card_content(*card_data))
-            if (i + 1) % 3 == 0:
-                elements.append(PageBreak())
-        except Exception as e:
-            print(f"Skipping {md_file}: {str(e)}")
-    if elements and isinstance(elements[-1], PageBreak):
-        elements.pop()
     doc.build(elements)
+    if new_cache != old_cache:
+        _save_parse_cache(new_cache)
 
 if __name__ == "__main__":
     input_directory = "/Users/hstagner/Documents/dev/index_export"
@@ -0,0 +1,75 @@
+"""Markdown parsing for the Bear index card script.
+
+Kept apart from the ReportLab rendering so the parse worker processes
+only need the standard library.
+"""
+import re
+
+# Stamped on cached parse results; bump whenever parse_markdown output changes
+PARSE_CACHE_VERSION = 3
+
+# ===== MARKDOWN PATTERNS =====
+_HDR = re.compile(r'^#{1,6}[ \t]+(.*?)[ \t]*$', re.M)
+_PAGE = re.compile(r'Page\s*(\d+)\s*-\s*(.*)')
+_BQ = re.compile(r'^>[ \t]?(.*(?:\n>[ \t]?.*)*)', re.M)
+_BQ_CONT = re.compile(r'\n>[ \t]?')
+_SRC = re.compile(r'\[\[(.*?)\]\]')
+_BLOCK_SEP = re.compile(r'\n[ \t]*\n')
+# Blocks that are not paragraphs: quotes and headings are skipped over, while
+# a list (as in MarkdownAnalyzer) absorbs every block after it
+_SKIP_BLOCK = re.compile(r'>|#')
+_LIST_BLOCK = re.compile(r'[-*+][ \t]|\d+[.)][ \t]')
+_ANA = re.compile(r'^[ \t]*\*\*Analysis:\*\*\s*(.*?)(?:\n[ \t]*\n|\Z)', re.M | re.S)
+
+def parse_markdown(filename):
+    """Single pass over the card file for the fields a card needs"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        text = f.read()
+    header_match = _HDR.search(text)
+    if not header_match:
+        raise ValueError(f"No headers found in {filename}")
+    header_text = header_match.group(1)
+    page_match = _PAGE.match(header_text)
+    if not page_match:
+        raise ValueError(f"Header format error in {filename}")
+    page_number, card_title = page_match.groups()
+    # The source is read from the first paragraph after the header only
+    first_para = ""
+    for block in _BLOCK_SEP.split(text[header_match.end():]):
+        block = block.strip()
+        if _LIST_BLOCK.match(block):
+            break
+        if block and not _SKIP_BLOCK.match(block):
+            first_para = block
+            break
+    # Plain str.find for the markers; the regexes only run when a marker is present
+    source = "Unknown"
+    start = first_para.find('[[')
+    if start != -1:
+        end = first_para.find(']]', start + 2)
+        if end != -1 and '\n' not in first_para[start + 2:end]:
+            source = first_para[start + 2:end]
+        else:
+            source_match = _SRC.search(first_para, start)
+            if source_match:
+                source = source_match.group(1)
+    quote_match = _BQ.search(text)
+    quote = _BQ_CONT.sub('\n', quote_match.group(1)).strip() if quote_match else ""
+    analysis = ""
+    if '**Analysis:**' in text:
+        analysis_match = _ANA.search(text)
+        if analysis_match:
+            analysis = analysis_match.group(1).strip()
+    return card_title, quote, analysis, source, page_number
+
+def process_one(md_path):
+    """Parse one markdown file in a worker process.
+
+    Returns (card_data, None) on success or (None, error_message) on failure.
+    Only plain strings cross the process boundary; flowables are built in
+    the main process.
+    """
+    try:
+        return parse_markdown(md_path), None
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,71 @@
+from card_parser import parse_markdown
+
+
+def write_note(tmp_path, text):
+    path = tmp_path / "note.md"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_parses_card_fields(tmp_path):
+    path = write_note(tmp_path, (
+        "# Page 12 - Title here\n"
+        "[[Src, Book]]\n"
+        "\n"
+        "> line one of quote\n"
+        "> line two of quote\n"
+        "\n"
+        "**Analysis:** first\n"
+        "second line\n"
+        "\n"
+        "Trailing\n"
+    ))
+    assert parse_markdown(path) == (
+        "Title here",
+        "line one of quote\nline two of quote",
+        "first\nsecond line",
+        "Src, Book",
+        "12",
+    )
+
+
+def test_tag_line_before_header_is_not_a_heading(tmp_path):
+    path = write_note(tmp_path, (
+        "#books #reading\n"
+        "# Page 7 - Tagged\n"
+        "[[Src]]\n"
+    ))
+    card_title, _, _, source, page_number = parse_markdown(path)
+    assert (card_title, source, page_number) == ("Tagged", "Src", "7")
+
+
+def test_source_only_read_from_first_paragraph(tmp_path):
+    path = write_note(tmp_path, (
+        "# Page 3 - No Source\n"
+        "\n"
+        "Opening paragraph.\n"
+        "\n"
+        "**Analysis:** see [[Other Note]]\n"
+    ))
+    _, _, analysis, source, _ = parse_markdown(path)
+    assert source == "Unknown"
+    assert analysis == "see [[Other Note]]"
+
+
+def test_source_skips_leading_blockquote(tmp_path):
+    path = write_note(tmp_path, "# Page 1 - T\n\n> a quote\n\n[[Src]]\n")
+    _, quote, _, source, _ = parse_markdown(path)
+    assert (quote, source) == ("a quote", "Src")
+
+
+def test_source_skips_list_items(tmp_path):
+    path = write_note(tmp_path, "# Page 4 - L\n\n- item [[NotSrc]]\n\nPara [[Src]]\n")
+    _, _, _, source, _ = parse_markdown(path)
+    assert source == "Unknown"
+
+
+def test_whitespace_only_line_ends_first_paragraph(tmp_path):
+    path = write_note(tmp_path, "# Page 5 - W\n\nOpening.\n \n**Analysis:** see [[Other]]\n")
+    _, _, analysis, source, _ = parse_markdown(path)
+    assert source == "Unknown"
+    assert analysis == "see [[Other]]"